@@ -1,10 +1,16 @@
 import sqlite3
 import datetime
+import pathlib
 
 
 class DBController:
-    def __init__(self, db_file):
-        self.conn = sqlite3.connect(db_file, isolation_level=None)
+    def __init__(self, db_file, read_only=False, check_same_thread=True):
+        if read_only:
+            uri = pathlib.Path(db_file).resolve().as_uri() + '?mode=ro'
+            self.conn = sqlite3.connect(uri, isolation_level=None, uri=True,
+                                        check_same_thread=check_same_thread)
+        else:
+            self.conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=check_same_thread)
         self.cur = self.conn.cursor()
 
     def __del__(self):
@@ -54,7 +60,13 @@ class DBController:
         if not username:
             cur.execute('SELECT fpid, username FROM fingerprints;')
         else:
-            cur.execute('SELECT fpid, username FROM fingerprints WHERE username LIKE "%{}%";'.format(username))
+            cur.execute('SELECT fpid, username FROM fingerprints WHERE username LIKE ?;', ('%{}%'.format(username),))
+        result = cur.fetchall()
+        return result
+
+    def get_fingers_by_user(self, username):
+        cur = self.cur
+        cur.execute('SELECT fpid, username FROM fingerprints WHERE username = ?;', (username,))
         result = cur.fetchall()
         return result
 
@@ -65,7 +77,7 @@ class DBController:
         return self.conn.execute('DELETE FROM fingerprints WHERE username = ?;', (username,)).rowcount
 
     def del_all_fingers(self):
-        return self.conn.execute('DELETE FROM fingerprints;')
+        return self.conn.execute('DELETE FROM fingerprints;').rowcount
 
     def record(self, username):
         now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -74,11 +86,11 @@ class DBController:
     def get_workrecord(self, date=None, username=None):
         cur = self.cur
         if date and username:
-            cur.execute('SELECT datetime, username FROM workrecord WHERE datetime like "%?%" AND username = ? '
-                        'ORDER BY datetime;', (date, username))
+            cur.execute('SELECT datetime, username FROM workrecord WHERE datetime LIKE ? AND username = ? '
+                        'ORDER BY datetime;', ('%{}%'.format(date), username))
         elif date:
-            cur.execute('SELECT datetime, username FROM workrecord WHERE datetime like "%?%" '
-                        'ORDER BY datetime;', (date,))
+            cur.execute('SELECT datetime, username FROM workrecord WHERE datetime LIKE ? '
+                        'ORDER BY datetime;', ('%{}%'.format(date),))
         elif username:
             cur.execute('SELECT datetime, username FROM workrecord WHERE username = ? ORDER BY datetime;', (username,))
         else:
@@ -86,6 +98,22 @@ class DBController:
         result = cur.fetchall()
         return result
 
+    def get_report(self, date=None):
+        """
+        attendance summary per user
+        :param date: str part of datetime e.g. 2019-04-01
+        :return: list of (username, first datetime, last datetime, punch count)
+        """
+        cur = self.cur
+        if date:
+            cur.execute('SELECT username, min(datetime), max(datetime), count(*) FROM workrecord '
+                        'WHERE datetime LIKE ? GROUP BY username ORDER BY username;', ('%{}%'.format(date),))
+        else:
+            cur.execute('SELECT username, min(datetime), max(datetime), count(*) FROM workrecord '
+                        'GROUP BY username ORDER BY username;')
+        result = cur.fetchall()
+        return result
+
 
 def test():
     con = DBController(':memory:')
@@ -96,10 +124,12 @@ def test():
     con.add_finger('kim sun woo')
     assert con.highest_fpid() == 1 and len(con.get_fingers()) == 1, 'db add one finger'
     assert con.get_fingers('sun woo')[0][1] == 'kim sun woo', 'should query correct'
+    assert con.get_fingers_by_user('sun woo') == [], 'exact username only'
     assert con.find_finger(1) == 'kim sun woo', 'find username by fingerprint id'
     print(con.find_finger(1))
     assert con.record('kim sun woo') == 1, 'attendance'
     print(con.get_workrecord())
+    assert con.get_report()[0][3] == 1, 'one punch in report'
     assert con.del_by_id(1) == 1, 'delete id result be 1'
     print(con.add_finger('kim sun woo'), con.add_finger('kim sun woo'))
     assert con.del_by_user('kim sun woo') == 2, 'del all by username'
\ No newline at end of file
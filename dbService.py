@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# Local query service of fingerprint database
+#
+# One process owns the single writer connection, lookups are served from a
+# pool of read-only WAL connections. Clients talk JSON over loopback HTTP.
+# There is no authentication, do not bind the service beyond loopback.
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import Request, urlopen
+
+from dbController import DBController
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+
+
+class QueryCache:
+    """
+    Short lived cache of query results, grouped by table so that a punch
+    only drops workrecord queries and keeps finger lookups warm.
+    Each table has a generation bumped on invalidate, a result queried
+    before a write is not stored after it.
+    """
+    def __init__(self, ttl=2.0, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.generations = {}
+
+    def generation(self, table):
+        with self.lock:
+            return self.generations.get(table, 0)
+
+    def get(self, table, key):
+        with self.lock:
+            entry = self.tables.get(table, {}).get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def put(self, table, key, value, generation):
+        with self.lock:
+            if self.generations.get(table, 0) != generation:
+                return
+            entries = self.tables.setdefault(table, {})
+            if len(entries) >= self.maxsize:
+                entries.clear()
+            entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, table):
+        with self.lock:
+            self.generations[table] = self.generations.get(table, 0) + 1
+            self.tables.pop(table, None)
+
+
+class ReadPool:
+    """
+    Pool of read-only DBController
+    """
+    def __init__(self, db_file, size=4):
+        self.pool = queue.Queue()
+        for _ in range(size):
+            self.pool.put(DBController(db_file, read_only=True, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        dbcon = self.pool.get()
+        try:
+            yield dbcon
+        finally:
+            self.pool.put(dbcon)
+
+
+class DBService:
+    """
+    Single writer and pooled readers over the same database file
+    """
+    READS = {
+        'find_finger': 'fingerprints',
+        'get_fingers': 'fingerprints',
+        'get_fingers_by_user': 'fingerprints',
+        'finger_count': 'fingerprints',
+        'get_workrecord': 'workrecord',
+        'get_report': 'workrecord',
+    }
+    WRITES = {
+        'add_finger': 'fingerprints',
+        'del_by_id': 'fingerprints',
+        'del_by_user': 'fingerprints',
+        'del_all_fingers': 'fingerprints',
+        'record': 'workrecord',
+    }
+
+    def __init__(self, db_file, pool_size=4, cache_ttl=2.0):
+        self.writer = DBController(db_file, check_same_thread=False)
+        self.writer.conn.execute('PRAGMA journal_mode=WAL;')
+        self.writer.set_up()
+        self.write_lock = threading.Lock()
+        self.readers = ReadPool(db_file, pool_size)
+        self.cache = QueryCache(cache_ttl) if cache_ttl else None
+
+    def read(self, name, *args):
+        table = self.READS[name]
+        key = (name,) + args
+        if self.cache:
+            result = self.cache.get(table, key)
+            if result is not None:
+                return result
+            generation = self.cache.generation(table)
+        with self.readers.connection() as dbcon:
+            result = getattr(dbcon, name)(*args)
+        if self.cache:
+            self.cache.put(table, key, result, generation)
+        return result
+
+    def write(self, name, *args):
+        with self.write_lock:
+            result = getattr(self.writer, name)(*args)
+            if self.cache:
+                self.cache.invalidate(self.WRITES[name])
+        if isinstance(result, int):
+            return result
+        return None
+
+
+class NotFound(Exception):
+    pass
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET    /fingers?username=        get_fingers
+    GET    /fingers?user=            get_fingers_by_user
+    GET    /fingers/<fpid>           find_finger
+    GET    /fingers/count            finger_count
+    GET    /workrecord?date=&username=
+    GET    /report?date=
+    POST   /fingers     {"username"}  add_finger
+    POST   /workrecord  {"username"}  record
+    DELETE /fingers?username=        del_by_user, empty username is 400
+    DELETE /fingers/<fpid>           del_by_id
+    DELETE /fingers/all              del_all_fingers
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, value, status=200):
+        body = json.dumps(value).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        return parts, params
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf8'))
+
+    def dispatch(self, method):
+        parts, params = self.parse()
+        service = self.server.service
+        if method == 'GET':
+            if parts == ['fingers'] and 'user' in params:
+                return service.read('get_fingers_by_user', params['user'])
+            if parts == ['fingers']:
+                return service.read('get_fingers', params.get('username'))
+            if parts == ['fingers', 'count']:
+                return service.read('finger_count')
+            if len(parts) == 2 and parts[0] == 'fingers':
+                return service.read('find_finger', int(parts[1]))
+            if parts == ['workrecord']:
+                return service.read('get_workrecord', params.get('date'), params.get('username'))
+            if parts == ['report']:
+                return service.read('get_report', params.get('date'))
+        elif method == 'POST':
+            body = self.read_body()
+            if parts == ['fingers']:
+                return service.write('add_finger', body['username'])
+            if parts == ['workrecord']:
+                return service.write('record', body['username'])
+        elif method == 'DELETE':
+            if parts == ['fingers']:
+                if not params.get('username', '').strip():
+                    raise ValueError('username is required')
+                return service.write('del_by_user', params['username'])
+            if parts == ['fingers', 'all']:
+                return service.write('del_all_fingers')
+            if len(parts) == 2 and parts[0] == 'fingers':
+                return service.write('del_by_id', int(parts[1]))
+        raise NotFound(self.path)
+
+    def handle_method(self, method):
+        try:
+            self.send_json({'result': self.dispatch(method)})
+        except NotFound as e:
+            self.send_json({'error': 'not found: {}'.format(e)}, 404)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json({'error': 'bad request: {}: {}'.format(type(e).__name__, e)}, 400)
+        except sqlite3.Error as e:
+            self.send_json({'error': 'database error: {}'.format(e)}, 500)
+
+    def do_GET(self):
+        self.handle_method('GET')
+
+    def do_POST(self):
+        self.handle_method('POST')
+
+    def do_DELETE(self):
+        self.handle_method('DELETE')
+
+
+def make_server(db_file, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=4, cache_ttl=2.0, verbose=False):
+    """
+    :return: ThreadingHTTPServer, call serve_forever() to start
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = DBService(db_file, pool_size, cache_ttl)
+    server.verbose = verbose
+    return server
+
+
+class DBClient:
+    """
+    Client of DBService with the same query methods as DBController
+    """
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5):
+        self.base = 'http://{}:{}'.format(host, port)
+        self.timeout = timeout
+
+    def request(self, method, path, params=None, body=None):
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        url = self.base + path
+        if params:
+            url += '?' + urlencode(params)
+        data = json.dumps(body).encode('utf8') if body is not None else None
+        req = Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+        with urlopen(req, timeout=self.timeout) as res:
+            return json.loads(res.read().decode('utf8'))['result']
+
+    def set_up(self):
+        """
+        tables are created by the service
+        """
+        pass
+
+    def finger_count(self):
+        return self.request('GET', '/fingers/count')
+
+    def find_finger(self, fpid):
+        return self.request('GET', '/fingers/{}'.format(int(fpid)))
+
+    def get_fingers(self, username=None):
+        return [tuple(row) for row in self.request('GET', '/fingers', {'username': username})]
+
+    def get_fingers_by_user(self, username):
+        return [tuple(row) for row in self.request('GET', '/fingers', {'user': username or ''})]
+
+    def get_workrecord(self, date=None, username=None):
+        return [tuple(row) for row in
+                self.request('GET', '/workrecord', {'date': date, 'username': username})]
+
+    def get_report(self, date=None):
+        return [tuple(row) for row in self.request('GET', '/report', {'date': date})]
+
+    def add_finger(self, user_name):
+        return self.request('POST', '/fingers', body={'username': user_name})
+
+    def record(self, username):
+        return self.request('POST', '/workrecord', body={'username': username})
+
+    def del_by_id(self, fpid):
+        return self.request('DELETE', '/fingers/{}'.format(int(fpid)))
+
+    def del_by_user(self, username):
+        return self.request('DELETE', '/fingers', {'username': username or ''})
+
+    def del_all_fingers(self):
+        return self.request('DELETE', '/fingers/all')
+
+
+def test():
+    import os
+    import tempfile
+    from urllib.error import HTTPError
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'test.db')
+    server = make_server(db_file, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = server.service
+    con = DBClient(port=server.server_address[1])
+
+    def status(method, path, body=None):
+        try:
+            con.request(method, path, body=body)
+        except HTTPError as e:
+            return e.code
+        return 200
+
+    try:
+        con.set_up()
+        assert con.add_finger('kim sun woo') == 1 and con.add_finger('kim') == 2
+        assert con.find_finger(2) == 'kim' and con.find_finger(9) == 'Nobody'
+        assert con.get_fingers('kim') == [(1, 'kim sun woo'), (2, 'kim')], 'LIKE match'
+        assert con.get_fingers_by_user('kim') == [(2, 'kim')], 'exact match'
+
+        assert con.record('kim') == 1
+        assert len(con.get_workrecord(username='kim')) == 1
+        assert 'fingerprints' in service.cache.tables, 'finger lookups are cached'
+        assert con.record('kim') == 1
+        assert 'fingerprints' in service.cache.tables, 'punch keeps finger cache'
+        assert len(con.get_workrecord(username='kim')) == 2, 'punch invalidates workrecord'
+        assert con.get_report()[0][3] == 2
+
+        generation = service.cache.generation('workrecord')
+        service.cache.invalidate('workrecord')
+        service.cache.put('workrecord', ('stale',), [], generation)
+        assert service.cache.get('workrecord', ('stale',)) is None, 'stale result is not stored'
+
+        assert status('GET', '/nope') == 404
+        assert status('POST', '/fingers', {}) == 400
+        assert status('POST', '/fingers', [1]) == 400
+        assert status('GET', '/fingers/abc') == 400
+        assert status('DELETE', '/fingers') == 400, 'delete without username'
+        assert status('DELETE', '/fingers?username=') == 400, 'delete with empty username'
+        try:
+            con.del_by_user(None)
+            assert False, 'client must not delete all'
+        except HTTPError as e:
+            assert e.code == 400
+        assert con.finger_count() == 2, 'nothing deleted by bad requests'
+
+        assert con.del_by_user('kim') == 1, 'del exact username'
+        assert con.get_fingers() == [(1, 'kim sun woo')]
+        assert con.del_all_fingers() == 1
+        assert con.get_fingers() == []
+    finally:
+        server.shutdown()
+        server.server_close()
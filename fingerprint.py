@@ -155,16 +155,19 @@ class FingerPrintReader:
         """
         Set Compare Level, the default value is 5, can be set to 0-9, the bigger, the stricter
         :param level: int 0-9
-        :return: int
+        :return: Response val level
         """
         if level < 0 or level > 9:
-            level = 5
-        cmd_buf = [Command.TAIL, Command.COMP_LEV, 0, level,
+            raise ValueError('level should be in range 0-9')
+        cmd_buf = [Command.HEAD, Command.COMP_LEV, 0, level,
                    0, 0, Command.CHK, Command.TAIL]
-        self.send_command_response(cmd_buf)
+        res = self.send_command_response(cmd_buf)
+        if res.ack != Ack.SUCCESS:
+            return res
         time.sleep(2)
         res = self.get_compare_level()
-        res.val = res.val[3]
+        if res.ack == Ack.SUCCESS:
+            res.val = res.val[3]
         return res
 
     def get_user_count(self):
@@ -192,6 +195,21 @@ class FingerPrintReader:
             res.val = res.val[3]
         return res
 
+    def set_timeout(self, timeout):
+        """
+        Set the time that fingerprint collection wait timeout
+        :param timeout: int 0-255, 0 is wait infinitely
+        :return: Response
+        """
+        if timeout < 0 or timeout > 255:
+            raise ValueError('timeout should be in range 0-255')
+        cmd_buf = [Command.HEAD, Command.TIMEOUT, 0, timeout,
+                   0, 0, Command.CHK, Command.TAIL]
+        res = self.send_command_response(cmd_buf)
+        if res.ack == Ack.SUCCESS:
+            res.val = res.val[3]
+        return res
+
     def add_user(self, user_id=None, user_pri=Privilege.MID):
         """
         Register fingerprint, 3 times attemps
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Load test of dbService: concurrent lookups while punches are written
+#
+# The service runs in its own process, either started here on a new database
+# or a running one given by --service, so client threads do not share its GIL.
+
+import argparse
+import collections
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from dbService import DBClient, DEFAULT_HOST
+
+
+class Errors:
+    """
+    Error count per exception type and the first exception of each
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.first = {}
+
+    def add(self, e):
+        name = type(e).__name__
+        with self.lock:
+            self.counts[name] += 1
+            self.first.setdefault(name, e)
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def reader_worker(client, fpids, stop, counts, errors, idx):
+    while not stop.is_set():
+        op = random.random()
+        try:
+            if op < 0.6:
+                client.find_finger(random.choice(fpids))
+            elif op < 0.8:
+                client.get_fingers()
+            elif op < 0.9:
+                client.get_report()
+            else:
+                client.get_workrecord(username='user{}'.format(random.choice(fpids)))
+            counts[idx] += 1
+        except Exception as e:
+            errors.add(e)
+            time.sleep(0.01)
+
+
+def punch_worker(client, fpids, stop, counts, errors, idx, interval):
+    while not stop.is_set():
+        try:
+            client.record('user{}'.format(random.choice(fpids)))
+            counts[idx] += 1
+        except Exception as e:
+            errors.add(e)
+            time.sleep(0.01)
+        if interval:
+            time.sleep(interval)
+
+
+def run(client, users, readers, punchers, duration, interval):
+    """
+    :return: (queries/s, punches/s, Errors)
+    """
+    fpids = [client.add_finger('user{}'.format(i + 1)) for i in range(users)]
+    stop = threading.Event()
+    errors = Errors()
+    read_counts = [0] * readers
+    punch_counts = [0] * punchers
+    threads = [threading.Thread(target=reader_worker,
+                                args=(client, fpids, stop, read_counts, errors, i))
+               for i in range(readers)]
+    threads += [threading.Thread(target=punch_worker,
+                                 args=(client, fpids, stop, punch_counts, errors, i, interval))
+                for i in range(punchers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(read_counts) / duration, sum(punch_counts) / duration, errors
+
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def start_service(db_file, host, pool, cache_ttl, timeout=10):
+    """
+    run `main.py serve` in a subprocess
+    :return: (Popen, DBClient)
+    """
+    port = free_port(host)
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    proc = subprocess.Popen([sys.executable, main_py, '--db', db_file, 'serve', '--host', host,
+                             '--http-port', str(port), '--pool', str(pool), '--cache-ttl', str(cache_ttl)],
+                            stdout=subprocess.DEVNULL)
+    client = DBClient(host, port)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client.finger_count()
+            return proc, client
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError('service did not start')
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='measure dbService queries per second under punch traffic')
+    parser.add_argument('--db', help='new database file to seed and serve (default: temp file), '
+                                     'never point this at a live database')
+    parser.add_argument('--service', metavar='HOST:PORT',
+                        help='running service to measure instead, it must serve an empty scratch database')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--punchers', type=int, default=2)
+    parser.add_argument('--interval', type=float, default=0.01, help='sleep between punches of a puncher')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--pool', type=int, default=4)
+    parser.add_argument('--cache-ttl', type=float, default=2.0, help='0 disables cache')
+    args = parser.parse_args()
+
+    proc = None
+    if args.service:
+        if args.db:
+            parser.error('--db and --service are exclusive')
+        host, _, port = args.service.rpartition(':')
+        client = DBClient(host or DEFAULT_HOST, int(port))
+        if client.finger_count():
+            parser.error('{} has fingerprints, load test only seeds an empty scratch database'.format(args.service))
+    else:
+        if args.db and os.path.exists(args.db):
+            parser.error('{} already exists, load test only seeds a new database'.format(args.db))
+        db_file = args.db or os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+        proc, client = start_service(db_file, args.host, args.pool, args.cache_ttl)
+    try:
+        qps, pps, errors = run(client, args.users, args.readers, args.punchers, args.duration, args.interval)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    print('readers: {}, punchers: {}, duration: {}s'.format(args.readers, args.punchers, args.duration))
+    print('queries/s: {:.1f}'.format(qps))
+    print('punches/s: {:.1f}'.format(pps))
+    print('errors: {}'.format(errors.total()))
+    for name, count in errors.counts.most_common():
+        print('  {}: {} (first: {})'.format(name, count, errors.first[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,392 @@
-from fingerprint import FingerPrintReader, Privilege, Ack
-from dbController import DBController
+#!/usr/bin/env python3
+# Command line interface of fingerprint reader
+#
+# Only the resources a subcommand needs are opened: `export` never touches the
+# serial port and `config` never opens the database. `batch` runs a script of
+# subcommands over a single serial / database session.
+
+import argparse
+import csv
+import shlex
 import sys
 
-sysDriver = {'win32': 'COM3', 'darwin':'/dev/cu.SLAB_USBtoUART', 'linux':'/dev/ttyUSB0'}
-port = sysDriver[sys.platform]
-fpr = FingerPrintReader(port, 19200)
-dbcon = DBController('sample.db')
-dbcon.set_up()
-
-def main():
-	while True:
-		show_input_command()
-
-
-def show_input_command():
-	print('0: auto verify, 1: add, 2: verify, 3:delete')
-	in_cmd = input('input command you want: ')
-	in_cmd = int(in_cmd)
-	if in_cmd == 1:
-		user_name = input('type username: ')
-		add_finger(user_name)
-	elif in_cmd == 2:
-		verify_finger()
-	elif in_cmd == 3:
-		user_name = input('type username: ')
-		delete_user(user_name)
-	elif in_cmd == 0:
-		while True:
-			verify_finger()
-
-
-def add_finger(user_name, privilege=2):
-    user_id = dbcon.add_finger(user_name)
-    res = fpr.add_user(user_id, Privilege(privilege))
+sysDriver = {'win32': 'COM3', 'darwin': '/dev/cu.SLAB_USBtoUART', 'linux': '/dev/ttyUSB0'}
+DEFAULT_DB = 'sample.db'
+DEFAULT_BAUDRATE = 19200
+
+
+class Session:
+    """
+    Lazily opened fingerprint reader and database connection.
+    With service (host:port) the database is reached through dbService.
+    """
+    def __init__(self, port=None, baudrate=DEFAULT_BAUDRATE, db_file=DEFAULT_DB, service=None):
+        self.port = port or sysDriver.get(sys.platform, '/dev/ttyS0')
+        self.baudrate = baudrate
+        self.db_file = db_file
+        self.service = service
+        self._fpr = None
+        self._dbcon = None
+
+    @property
+    def fpr(self):
+        if self._fpr is None:
+            from fingerprint import FingerPrintReader
+            self._fpr = FingerPrintReader(self.port, self.baudrate)
+        return self._fpr
+
+    @property
+    def dbcon(self):
+        if self._dbcon is None:
+            if self.service:
+                from dbService import DBClient
+                host, _, port = self.service.rpartition(':')
+                self._dbcon = DBClient(host or '127.0.0.1', int(port))
+            else:
+                from dbController import DBController
+                self._dbcon = DBController(self.db_file)
+            self._dbcon.set_up()
+        return self._dbcon
+
+    def close(self):
+        self._fpr = None
+        self._dbcon = None
+
+
+def add_finger(session, user_name, privilege=2):
+    from fingerprint import Privilege, Ack
+    user_id = session.dbcon.add_finger(user_name)
+    res = session.fpr.add_user(user_id, Privilege(privilege))
+    if res.ack != Ack.SUCCESS:
+        session.dbcon.del_by_id(user_id)
     print(res)
+    return res
 
 
-def verify_finger():
-	res = fpr.compare_many()
-	if res.ack == Ack.SUCCESS:
-		user = res.val
-		user_name = dbcon.find_finger(user.id)
-		dbcon.record(user_name)
-		print(res)
-	else:
-		print(res)
+def verify_finger(session):
+    from fingerprint import Ack
+    res = session.fpr.compare_many()
+    if res.ack == Ack.SUCCESS:
+        user = res.val
+        user_name = session.dbcon.find_finger(user.id)
+        session.dbcon.record(user_name)
+    print(res)
+    return res
+
 
+def delete_user(session, user_name):
+    """
+    delete fingerprints of exactly user_name from module and database
+    :return: list of Response or None if user_name is empty
+    """
+    from fingerprint import Ack
+    if not user_name or not user_name.strip():
+        print('username is empty', file=sys.stderr)
+        return None
+    responses = []
+    for fpid, name in session.dbcon.get_fingers_by_user(user_name):
+        res = session.fpr.del_specified_user(fpid)
+        if res.ack == Ack.SUCCESS:
+            session.dbcon.del_by_id(fpid)
+        print(res)
+        responses.append(res)
+    return responses
 
 
-def delete_user(user_name):
-    fingers = dbcon.get_fingers(user_name)
-    dbcon.del_by_user(user_name)
-    for fpid, name in fingers:
-        res = fpr.del_specified_user(fpid)
+def initialize(session):
+    from fingerprint import Ack
+    res = session.fpr.get_user_count()
+    if res.ack != Ack.SUCCESS:
         print(res)
+    elif len(session.dbcon.get_fingers()) != res.val:
+        session.dbcon.del_all_fingers()
+        res = session.fpr.clear_all_users()
+        print('All data clear')
+    else:
+        print('Nothing happen')
+    return res
+
+
+def exit_code(*responses):
+    """
+    :param responses: Response of fingerprint reader
+    :return: 0 if every ack is SUCCESS else 1
+    """
+    from fingerprint import Ack
+    return 0 if all(res.ack == Ack.SUCCESS for res in responses) else 1
+
+
+def ranged_int(low, high):
+    def parse(value):
+        value = int(value)
+        if value < low or value > high:
+            raise argparse.ArgumentTypeError('{} is not in range {}-{}'.format(value, low, high))
+        return value
+    return parse
+
+
+def show_input_command(session):
+    print('0: auto verify, 1: add, 2: verify, 3:delete')
+    in_cmd = input('input command you want: ')
+    in_cmd = int(in_cmd)
+    if in_cmd == 1:
+        user_name = input('type username: ')
+        add_finger(session, user_name)
+    elif in_cmd == 2:
+        verify_finger(session)
+    elif in_cmd == 3:
+        user_name = input('type username: ')
+        delete_user(session, user_name)
+    elif in_cmd == 0:
+        while True:
+            verify_finger(session)
+
+
+def cmd_menu(session, args):
+    while True:
+        show_input_command(session)
+
+
+def cmd_enroll(session, args):
+    return exit_code(add_finger(session, args.username, args.privilege))
+
+
+def cmd_verify(session, args):
+    count = 0
+    failed = 0
+    while not args.count or count < args.count:
+        failed |= exit_code(verify_finger(session))
+        count += 1
+    return failed
+
+
+def cmd_delete(session, args):
+    responses = delete_user(session, args.username)
+    if responses is None:
+        return 1
+    return exit_code(*responses)
+
+
+def cmd_sync(session, args):
+    return exit_code(initialize(session))
+
+
+def cmd_export(session, args):
+    if args.table == 'fingers':
+        rows = session.dbcon.get_fingers(args.username)
+        header = ('fpid', 'username')
+    else:
+        rows = session.dbcon.get_workrecord(args.date, args.username)
+        header = ('datetime', 'username')
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def cmd_config(session, args):
+    fpr = session.fpr
+    responses = []
+    if args.level is not None:
+        responses.append(fpr.set_compare_level(args.level))
+    if args.timeout is not None:
+        responses.append(fpr.set_timeout(args.timeout))
+    if args.add_mode is not None:
+        responses.append(fpr.set_add_mode(args.add_mode))
+    if responses:
+        for res in responses:
+            print(res)
+    else:
+        for name, get in (('compare level', fpr.get_compare_level), ('timeout', fpr.get_timeout),
+                          ('add mode', fpr.get_add_mode), ('user count', fpr.get_user_count)):
+            res = get()
+            print('{}:'.format(name), res)
+            responses.append(res)
+    return exit_code(*responses)
+
+
+def cmd_serve(session, args):
+    from dbService import make_server
+    server = make_server(session.db_file, args.host, args.http_port, args.pool, args.cache_ttl, args.verbose)
+    print('serving {} on {}:{}'.format(session.db_file, *server.server_address))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def cmd_batch(session, args):
+    """
+    Run every line of script as a subcommand over the same session.
+    Blank lines and lines starting with '#' are skipped.
+    :return: 1 if any line failed else 0
+    """
+    parser = build_parser(batch=True)
+    failed = 0
+    script = open(args.script) if args.script != '-' else sys.stdin
+    try:
+        for lineno, line in enumerate(script, 1):
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            try:
+                sub_args = parser.parse_args(argv)
+                if sub_args.func(session, sub_args):
+                    print('line {}: command failed: {}'.format(lineno, line.strip()), file=sys.stderr)
+                    failed = 1
+            except SystemExit:
+                print('line {}: invalid command: {}'.format(lineno, line.strip()), file=sys.stderr)
+                failed = 1
+            except Exception as e:
+                print('line {}: {}: {}'.format(lineno, type(e).__name__, e), file=sys.stderr)
+                failed = 1
+            if failed and not args.keep_going:
+                break
+    finally:
+        if script is not sys.stdin:
+            script.close()
+    return failed
+
+
+def build_parser(batch=False):
+    """
+    :param batch: build the parser used for lines of batch script,
+                  without session options and nested batch
+    :return: ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog='' if batch else None,
+                                     description='WaveShare UART fingerprint reader')
+    if not batch:
+        parser.add_argument('--port', help='serial port (default: platform dependent)')
+        parser.add_argument('--baudrate', type=int, default=DEFAULT_BAUDRATE)
+        parser.add_argument('--db', default=DEFAULT_DB, help='sqlite database file')
+        parser.add_argument('--service', metavar='HOST:PORT',
+                            help='use database through running serve instead of --db')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('enroll', help='register fingerprint of user')
+    p.add_argument('username')
+    p.add_argument('--privilege', type=int, choices=(1, 2, 3), default=2)
+    p.set_defaults(func=cmd_enroll)
+
+    p = subparsers.add_parser('verify', help='compare fingerprint 1:N and record attendance')
+    p.add_argument('-n', '--count', type=int, default=1, help='times to verify, 0 is forever')
+    p.set_defaults(func=cmd_verify)
+
+    p = subparsers.add_parser('delete', help='delete fingerprints of user')
+    p.add_argument('username')
+    p.set_defaults(func=cmd_delete)
+
+    p = subparsers.add_parser('sync', help='clear all data if database and module mismatch')
+    p.set_defaults(func=cmd_sync)
+
+    p = subparsers.add_parser('export', help='export database as csv')
+    p.add_argument('table', choices=('fingers', 'workrecord'))
+    p.add_argument('--date', help='workrecord date filter, e.g. 2019-04-01')
+    p.add_argument('--username')
+    p.add_argument('-o', '--output', help='output file (default: stdout)')
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser('config', help='read or set module parameters')
+    p.add_argument('--level', type=ranged_int(0, 9), help='compare level 0-9')
+    p.add_argument('--timeout', type=ranged_int(0, 255), help='capture timeout 0-255, 0 is wait infinitely')
+    p.add_argument('--add-mode', type=int, choices=(0, 1), help='0 allow repeat, 1 prohibit')
+    p.set_defaults(func=cmd_config)
+
+    if not batch:
+        p = subparsers.add_parser('batch', help='run a script of commands over one session')
+        p.add_argument('script', help="script file, '-' for stdin")
+        p.add_argument('-k', '--keep-going', action='store_true', help='continue after a failed line')
+        p.set_defaults(func=cmd_batch)
+
+        p = subparsers.add_parser('serve', help='serve database queries to local clients')
+        p.add_argument('--host', default='127.0.0.1')
+        p.add_argument('--http-port', type=int, default=8642)
+        p.add_argument('--pool', type=int, default=4, help='read-only connections')
+        p.add_argument('--cache-ttl', type=float, default=2.0, help='seconds, 0 disables cache')
+        p.add_argument('-v', '--verbose', action='store_true')
+        p.set_defaults(func=cmd_serve)
+
+        p = subparsers.add_parser('menu', help='interactive menu (default)')
+        p.set_defaults(func=cmd_menu)
+    return parser
+
+
+def main(argv=None, session=None):
+    """
+    :param argv: list of arguments, sys.argv[1:] if None
+    :param session: Session to run over, opened from arguments if None
+    :return: exit code
+    """
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        args.func = cmd_menu
+    own_session = session is None
+    if own_session:
+        session = Session(args.port, args.baudrate, args.db, args.service)
+    try:
+        return args.func(session, args)
+    finally:
+        if own_session:
+            session.close()
+
+
+def test():
+    import os
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    db = os.path.join(tmp, 'test.db')
+    script = os.path.join(tmp, 'script.txt')
+
+    def write_script(*lines):
+        with open(script, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    assert 'fingerprint' not in sys.modules, 'run test in a fresh interpreter'
+    write_script('# export only', '', 'export fingers -o ' + os.path.join(tmp, 'fingers.csv'))
+    assert main(['--db', db, 'batch', script]) == 0, 'export script succeeds'
+    assert 'fingerprint' not in sys.modules, 'export should not import fingerprint'
+
+    write_script('bogus', 'export fingers -o ' + os.path.join(tmp, 'after.csv'))
+    assert main(['--db', db, 'batch', script]) == 1, 'invalid line fails batch'
+    assert not os.path.exists(os.path.join(tmp, 'after.csv')), 'batch stops at failed line'
+    assert main(['--db', db, 'batch', '-k', script]) == 1, 'keep going still reports failure'
+    assert os.path.exists(os.path.join(tmp, 'after.csv')), 'keep going runs following lines'
+
+    from fingerprint import Ack, Response
+
+    class StubReader:
+        def __init__(self):
+            self.ack = Ack.SUCCESS
+            self.deleted = []
+
+        def add_user(self, user_id, user_pri):
+            return Response(self.ack)
+
+        def del_specified_user(self, user_id):
+            self.deleted.append(user_id)
+            return Response(self.ack)
 
+    session = Session(db_file=db)
+    session._fpr = StubReader()
+    write_script('enroll kim', 'enroll "kim sun woo"', 'delete kim')
+    assert main(['--db', db, 'batch', script], session) == 0, 'enroll and delete succeed'
+    assert session._fpr.deleted == [1], 'delete only exact username'
+    assert session.dbcon.get_fingers() == [(2, 'kim sun woo')]
 
-def initialize():
-	if len(dbcon.get_fingers()) != fpr.get_user_count():
-		dbcon.del_all_fingers()
-		fpr.clear_all_users()
-		print('All data clear')
-	else:
-		print('Nothing happen')
+    session._fpr.ack = Ack.TIMEOUT
+    write_script('enroll lee', 'delete ""')
+    assert main(['--db', db, 'batch', '-k', script], session) == 1, 'device failure fails batch'
+    assert session.dbcon.get_fingers_by_user('lee') == [], 'failed enroll leaves no row'
 
 
 if __name__ == '__main__':
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         print('\n\n Finished! \n')
         sys.exit()